@@ -1,27 +1,33 @@
+import hashlib
 import math
 import numpy as np
 import os
 import torch
-import xml.etree.ElementTree as ET
 
 from isaacgym import gymutil, gymtorch, gymapi
 from isaacgym.torch_utils import *
 from tasks.base.vec_task import VecTask
 
-def _indent_xml(elem, level=0):
-	i = "\n" + level * "  "
-	if len(elem):
-		if not elem.text or not elem.text.strip():
-			elem.text = i + "  "
-		if not elem.tail or not elem.tail.strip():
-			elem.tail = i
-		for elem in elem:
-			_indent_xml(elem, level + 1)
-		if not elem.tail or not elem.tail.strip():
-			elem.tail = i
-	else:
-		if level and (not elem.tail or not elem.tail.strip()):
-			elem.tail = i
+_BALANCE_BOT_XML = """<mujoco model="BalanceBot">
+  <compiler angle="degree" coordinate="local" inertiafromgeom="true" />
+  <worldbody>
+    <body name="tray" pos="0 0 {tray_height:g}">
+      <joint name="root_joint" type="free" />
+      <geom type="cylinder" size="{tray_radius:g} {tray_half_thickness:g}" pos="0 0 0" density="100" />
+{legs}    </body>
+  </worldbody>
+</mujoco>
+"""
+
+_BALANCE_BOT_LEG_XML = """      <body name="upper_leg{i}" pos="{upper_pos.x:g} {upper_pos.y:g} {upper_pos.z:g}" quat="{upper_quat.w:g} {upper_quat.x:g} {upper_quat.y:g} {upper_quat.z:g}">
+        <geom type="capsule" size="{leg_radius:g} {leg_half_length:g}" density="1000" />
+        <joint name="upper_leg_joint{i}" type="hinge" pos="0 0 {joint_z:g}" axis="0 1 0" limited="true" range="-45 45" />
+        <body name="lower_leg{i}" pos="{lower_pos.x:g} {lower_pos.y:g} {lower_pos.z:g}" quat="{lower_quat.w:g} {lower_quat.x:g} {lower_quat.y:g} {lower_quat.z:g}">
+          <geom type="capsule" size="{leg_radius:g} {leg_half_length:g}" density="1000" />
+          <joint name="lower_leg_joint{i}" type="hinge" pos="0 0 {joint_z:g}" axis="0 1 0" limited="true" range="-70 90" />
+        </body>
+      </body>
+"""
 
 class BallBalance(VecTask) :
 
@@ -36,6 +42,8 @@ class BallBalance(VecTask) :
 		self.max_episode_length = self.cfg["env"]["maxEpisodeLength"]
 		self.action_speed_scale = self.cfg["env"]["actionSpeedScale"]
 		self.debug_viz = self.cfg["env"]["enableDebugVis"]
+		self.bf16_obs = self.cfg["env"].get("enableBf16Obs", False)
+		self.reset_graph = self.cfg["env"].get("enableResetGraph", False)
 
 		sensors_per_env = 3
 		actors_per_env = 2
@@ -62,9 +70,14 @@ class BallBalance(VecTask) :
 
 		print("root tensor:", self.root_tensor.shape)
 		
-		vec_root_tensor = gymtorch.wrap_tensor(self.root_tensor).view(self.num_envs, dofs_per_env, 13)
-		vec_dof_tensor = gymtorch.wrap_tensor(self.root_tensor).view(self.num_envs, dofs_per_env, 2)
-		vec_sensor_tensor = gymtorch.wrap_tensor(self.sensor_tensor).view(self.num_envs, sensors_per_env, 6)
+		# wrap each gym buffer once, everything below is a view into these
+		root_wrapped = gymtorch.wrap_tensor(self.root_tensor)
+		dof_wrapped = gymtorch.wrap_tensor(self.dof_state_tensor)
+		sensor_wrapped = gymtorch.wrap_tensor(self.sensor_tensor)
+
+		vec_root_tensor = root_wrapped.view(self.num_envs, actors_per_env, 13)
+		vec_dof_tensor = dof_wrapped.view(self.num_envs, dofs_per_env, 2)
+		vec_sensor_tensor = sensor_wrapped.view(self.num_envs, sensors_per_env, 6)
 
 		self.root_states = vec_root_tensor
 		self.tray_positions = vec_root_tensor[..., 0, 0:3]
@@ -73,6 +86,10 @@ class BallBalance(VecTask) :
 		self.ball_linvels = vec_root_tensor[..., 1, 7:10]	# linear velocity
 		self.ball_angvels = vec_root_tensor[..., 1, 10:13]	# angular velocity
 
+		# contiguous copies of the root state fields read every step, refreshed in post_physics_step
+		self._ball_pos_soa = torch.empty((self.num_envs, 3), dtype=torch.float32, device=self.device)
+		self._ball_linvel_soa = torch.empty((self.num_envs, 3), dtype=torch.float32, device=self.device)
+
 		self.dof_states = vec_dof_tensor
 		self.dof_positions = vec_dof_tensor[..., 0]
 		self.dof_velocities = vec_dof_tensor[..., 1]
@@ -88,10 +105,42 @@ class BallBalance(VecTask) :
 
 		self.dof_position_targets = torch.zeros((self.num_envs, dofs_per_env), dtype=torch.float32, device=self.device, requires_grad=False)
 
+		# optional bfloat16 copy of the clipped observations, handed out as obs_dict["obs_bf16"]
+		self.obs_buf_bf16 = None
+		if self.bf16_obs :
+			self.obs_buf_bf16 = torch.empty((self.num_envs, self.num_obs), dtype=torch.bfloat16, device=self.rl_device)
+
+		# desired ball position for the reward, 0.7 above the ground plane
+		self._reward_target = torch.tensor([0.0, 0.0, 0.7], dtype=torch.float32, device=self.device)
+		# episode ends once the ball drops below this height
+		self._reset_height = 1.5 * self.ball_radius
+
+		self._torch_device = torch.device(self.device)
+
+		# actuated dof indices used on every step, kept on the sim device
+		self._actuated_idx = torch.tensor([1, 3, 5], dtype=torch.long, device=self.device)
+
+		# uniform samples for reset_idx, sized for resetting every env at once
+		# columns: horizontal dist, horizontal direction, height, horizontal speed
+		self._reset_rand = torch.empty((self.num_envs, 4), dtype=torch.float32, device=self.device)
+		# ball root states written by reset_idx; identity orientation and zero angular velocity never change
+		self._ball_reset_states = torch.zeros((self.num_envs, 13), dtype=torch.float32, device=self.device)
+		self._ball_reset_states[:, 6] = 1
+
 		self.all_actor_indices = torch.arange(actors_per_env * self.num_envs, dtype=torch.int32, device=self.device).view(self.num_envs, actors_per_env)
 		self.all_bot_indices = actors_per_env * torch.arange(self.num_envs, dtype=torch.int32, device=self.device)
 
+		# actor indices handed to the indexed gym setters in reset_idx
+		self._actor_idx_scratch = torch.empty((self.num_envs, actors_per_env), dtype=torch.int32, device=self.device)
+		self._bot_idx_scratch = torch.empty(self.num_envs, dtype=torch.int32, device=self.device)
+
+		# resetting every env at once has a fixed shape, so its tensor work can be replayed from a cuda graph
+		self.reset_graph = self.reset_graph and self.device != "cpu"
+		self._full_reset_graph = None
+		self._all_env_ids = torch.arange(self.num_envs, dtype=torch.long, device=self.device)
+
 		self.axes_geom = gymutil.AxesGeometry(0.2)
+		self.num_debug_viz_envs = min(4, self.num_envs)	# only the first few envs get axes drawn
 	
 	def create_sim(self) :
 		
@@ -117,76 +166,55 @@ class BallBalance(VecTask) :
 
 		tray_height = leg_length * math.sqrt(2) + 2 * leg_radius + 0.5 * tray_thickness
 
-		root = ET.Element('mujoco')
-		root.attrib["model"] = "BalanceBot"
-		compiler = ET.SubElement(root, "compiler")
-		compiler.attrib["angle"] = "degree"
-		compiler.attrib["coordinate"] = "local"
-		compiler.attrib["inertiafromgeom"] = "true"
-		worldbody = ET.SubElement(root, "worldbody")
-
-		tray = ET.SubElement(worldbody, "body")
-		tray.attrib["name"] = "tray"
-		tray.attrib["pos"] = "%g %g %g" % (0, 0, tray_height)
-		tray_joint = ET.SubElement(tray, "joint")
-		tray_joint.attrib["name"] = "root_joint"
-		tray_joint.attrib["type"] = "free"
-		tray_geom = ET.SubElement(tray, "geom")
-		tray_geom.attrib["type"] = "cylinder"
-		tray_geom.attrib["size"] = "%g %g" % (tray_radius, 0.5 * tray_thickness)
-		tray_geom.attrib["pos"] = "0 0 0"
-		tray_geom.attrib["density"] = "100"
-
 		leg_angles = [0.0, 2.0 / 3.0 * math.pi, 4.0 / 3.0 * math.pi]
+		leg_cos = np.cos(leg_angles)
+		leg_sin = np.sin(leg_angles)
+
+		lower_leg_pos = gymapi.Vec3(-0.5 * leg_length, 0, 0.5 * leg_length)
+		lower_leg_quat = gymapi.Quat.from_euler_zyx(0, -0.5 * math.pi, 0)
+
+		legs = []
 		for i in range(len(leg_angles)):
 			angle = leg_angles[i]
 
 			upper_leg_from = gymapi.Vec3()
-			upper_leg_from.x = leg_outer_offset * math.cos(angle)
-			upper_leg_from.y = leg_outer_offset * math.sin(angle)
+			upper_leg_from.x = leg_outer_offset * leg_cos[i]
+			upper_leg_from.y = leg_outer_offset * leg_sin[i]
 			upper_leg_from.z = -leg_radius - 0.5 * tray_thickness
 			upper_leg_to = gymapi.Vec3()
-			upper_leg_to.x = leg_inner_offset * math.cos(angle)
-			upper_leg_to.y = leg_inner_offset * math.sin(angle)
+			upper_leg_to.x = leg_inner_offset * leg_cos[i]
+			upper_leg_to.y = leg_inner_offset * leg_sin[i]
 			upper_leg_to.z = upper_leg_from.z - leg_length / math.sqrt(2)
-			upper_leg_pos = (upper_leg_from + upper_leg_to) * 0.5
-			upper_leg_quat = gymapi.Quat.from_euler_zyx(0, -0.75 * math.pi, angle)
-			upper_leg = ET.SubElement(tray, "body")
-			upper_leg.attrib["name"] = "upper_leg" + str(i)
-			upper_leg.attrib["pos"] = "%g %g %g" % (upper_leg_pos.x, upper_leg_pos.y, upper_leg_pos.z)
-			upper_leg.attrib["quat"] = "%g %g %g %g" % (upper_leg_quat.w, upper_leg_quat.x, upper_leg_quat.y, upper_leg_quat.z)
-			upper_leg_geom = ET.SubElement(upper_leg, "geom")
-			upper_leg_geom.attrib["type"] = "capsule"
-			upper_leg_geom.attrib["size"] = "%g %g" % (leg_radius, 0.5 * leg_length)
-			upper_leg_geom.attrib["density"] = "1000"
-			upper_leg_joint = ET.SubElement(upper_leg, "joint")
-			upper_leg_joint.attrib["name"] = "upper_leg_joint" + str(i)
-			upper_leg_joint.attrib["type"] = "hinge"
-			upper_leg_joint.attrib["pos"] = "%g %g %g" % (0, 0, -0.5 * leg_length)
-			upper_leg_joint.attrib["axis"] = "0 1 0"
-			upper_leg_joint.attrib["limited"] = "true"
-			upper_leg_joint.attrib["range"] = "-45 45"
-
-			lower_leg_pos = gymapi.Vec3(-0.5 * leg_length, 0, 0.5 * leg_length)
-			lower_leg_quat = gymapi.Quat.from_euler_zyx(0, -0.5 * math.pi, 0)
-			lower_leg = ET.SubElement(upper_leg, "body")
-			lower_leg.attrib["name"] = "lower_leg" + str(i)
-			lower_leg.attrib["pos"] = "%g %g %g" % (lower_leg_pos.x, lower_leg_pos.y, lower_leg_pos.z)
-			lower_leg.attrib["quat"] = "%g %g %g %g" % (lower_leg_quat.w, lower_leg_quat.x, lower_leg_quat.y, lower_leg_quat.z)
-			lower_leg_geom = ET.SubElement(lower_leg, "geom")
-			lower_leg_geom.attrib["type"] = "capsule"
-			lower_leg_geom.attrib["size"] = "%g %g" % (leg_radius, 0.5 * leg_length)
-			lower_leg_geom.attrib["density"] = "1000"
-			lower_leg_joint = ET.SubElement(lower_leg, "joint")
-			lower_leg_joint.attrib["name"] = "lower_leg_joint" + str(i)
-			lower_leg_joint.attrib["type"] = "hinge"
-			lower_leg_joint.attrib["pos"] = "%g %g %g" % (0, 0, -0.5 * leg_length)
-			lower_leg_joint.attrib["axis"] = "0 1 0"
-			lower_leg_joint.attrib["limited"] = "true"
-			lower_leg_joint.attrib["range"] = "-70 90"
-
-		_indent_xml(root)
-		ET.ElementTree(root).write("balance_bot.xml")	# save the xml to file
+
+			legs.append(_BALANCE_BOT_LEG_XML.format(
+				i=i,
+				upper_pos=(upper_leg_from + upper_leg_to) * 0.5,
+				upper_quat=gymapi.Quat.from_euler_zyx(0, -0.75 * math.pi, angle),
+				lower_pos=lower_leg_pos,
+				lower_quat=lower_leg_quat,
+				leg_radius=leg_radius,
+				leg_half_length=0.5 * leg_length,
+				joint_z=-0.5 * leg_length
+			))
+
+		xml = _BALANCE_BOT_XML.format(
+			tray_height=tray_height,
+			tray_radius=tray_radius,
+			tray_half_thickness=0.5 * tray_thickness,
+			legs="".join(legs)
+		)
+
+		# the first line holds a hash of the rendered xml, skip the write when the file already matches
+		asset_file = "balance_bot.xml"
+		header = "<!-- %s -->\n" % hashlib.md5(xml.encode()).hexdigest()
+		rewrite = True
+		if os.path.exists(asset_file) :
+			with open(asset_file) as f :
+				rewrite = f.readline() != header
+
+		if rewrite :
+			with open(asset_file, "w") as f :	# save the xml to file
+				f.write(header + xml)
 
 		# save some useful robot parameters
 		self.tray_height = tray_height
@@ -194,6 +222,8 @@ class BallBalance(VecTask) :
 		self.leg_length = leg_length
 		self.leg_outer_offset = leg_outer_offset
 		self.leg_angles = leg_angles
+		self.leg_cos = leg_cos
+		self.leg_sin = leg_sin
 	
 	def _create_ground_plane(self) :
 
@@ -241,10 +271,10 @@ class BallBalance(VecTask) :
 
 		# create force sensors on tray
 		bot_tray_idx = self.gym.find_asset_rigid_body_index(bot_asset, "tray")
-		for angle in self.leg_angles :
+		for k in range(len(self.leg_angles)) :
 			sensor_pose = gymapi.Transform()
-			sensor_pose.p.x = self.leg_outer_offset * math.cos(angle)
-			sensor_pose.p.y = self.leg_outer_offset * math.sin(angle)
+			sensor_pose.p.x = self.leg_outer_offset * self.leg_cos[k]
+			sensor_pose.p.y = self.leg_outer_offset * self.leg_sin[k]
 			self.gym.create_asset_force_sensor(bot_asset, bot_tray_idx, sensor_pose)
 
 		""" asset configuration for bot end """
@@ -270,10 +300,37 @@ class BallBalance(VecTask) :
 
 		""" asset placing into simulator """
 
+		# dof properties are the same for every bot, set them up once
+		actuated_dofs = np.array([1, 3, 5])
+		free_dofs = np.array([0, 2, 4])
+
+		dof_props = bot_dof_props.copy()
+		dof_props['driveMode'][actuated_dofs] = gymapi.DOF_MODE_POS
+		dof_props['stiffness'][actuated_dofs] = 4000.0
+		dof_props['damping'][actuated_dofs] = 100.0
+		dof_props['driveMode'][free_dofs] = gymapi.DOF_MODE_NONE
+		dof_props['stiffness'][free_dofs] = 0
+		dof_props['damping'][free_dofs] = 0
+
+		# attractor settings shared by every leg, the world pose is set per leg below
+		attractor_props = gymapi.AttractorProperties()
+		attractor_props.stiffness = 5e7
+		attractor_props.damping = 5e3
+		attractor_props.axes = gymapi.AXIS_TRANSLATION
+		attractor_props.target.p.z = self.leg_radius
+		attractor_props.offset.p.z = 0.5 * self.leg_length
+
+		# colors only matter when something renders, i.e. a viewer or camera sensors
+		use_colors = self.graphics_device_id != -1
+		ball_color = gymapi.Vec3(0.99, 0.66, 0.25)
+		tray_color = gymapi.Vec3(0.48, 0.65, 0.8)
+		leg_color = gymapi.Vec3(0.15, 0.2, 0.3)
+		bot_colors = [(0, tray_color)] + [(j, leg_color) for j in range(1, 7)]
+
 		# place assets
 		self.envs = []
-		self.bot_handles = []
-		self.obj_handles = []
+		self.bot_handles = np.empty(self.num_envs, dtype=np.int32)
+		self.obj_handles = np.empty(self.num_envs, dtype=np.int32)
 		for i in range(self.num_envs) :
 			# get the pointer to env
 			env_ptr = self.gym.create_env(self.sim, lower, upper, num_per_row)
@@ -281,112 +338,108 @@ class BallBalance(VecTask) :
 
 			# place bot!!!
 			bot_handle = self.gym.create_actor(env_ptr, bot_asset, bot_pose, "bot", i, 0, 0)
-			self.bot_handles.append(bot_handle)
+			self.bot_handles[i] = bot_handle
 
 			# place ball!!!
 			ball_handle = self.gym.create_actor(env_ptr, ball_asset, ball_pose, "ball", i, 0, 0)
-			self.obj_handles.append(ball_handle)
-
-			actuated_dofs = np.array([1,3,5])
-			free_dofs = np.array([0, 2, 4])
+			self.obj_handles[i] = ball_handle
 
 			# set bot properties
-			dof_props = self.gym.get_actor_dof_properties(env_ptr, bot_handle)
-			dof_props['driveMode'][actuated_dofs] = gymapi.DOF_MODE_POS
-			dof_props['stiffness'][actuated_dofs] = 4000.0
-			dof_props['damping'][actuated_dofs] = 100.0
-			dof_props['driveMode'][free_dofs] = gymapi.DOF_MODE_NONE
-			dof_props['stiffness'][free_dofs] = 0
-			dof_props['damping'][free_dofs] = 0
 			self.gym.set_actor_dof_properties(env_ptr, bot_handle, dof_props)
 
 			# find handles for legs. handles are used for fixing this bot
-			lower_leg_handles = []
-			lower_leg_handles.append(self.gym.find_actor_rigid_body_handle(env_ptr, bot_handle, "lower_leg0"))
-			lower_leg_handles.append(self.gym.find_actor_rigid_body_handle(env_ptr, bot_handle, "lower_leg1"))
-			lower_leg_handles.append(self.gym.find_actor_rigid_body_handle(env_ptr, bot_handle, "lower_leg2"))
+			# rigid body handles are env-local and every env has the same actors, so look them up once
+			if i == 0 :
+				lower_leg_handles = []
+				lower_leg_handles.append(self.gym.find_actor_rigid_body_handle(env_ptr, bot_handle, "lower_leg0"))
+				lower_leg_handles.append(self.gym.find_actor_rigid_body_handle(env_ptr, bot_handle, "lower_leg1"))
+				lower_leg_handles.append(self.gym.find_actor_rigid_body_handle(env_ptr, bot_handle, "lower_leg2"))
+
+				# upper leg handles are only used for debug visualization
+				self._upper_leg_handles = [
+					self.gym.find_actor_rigid_body_handle(env_ptr, bot_handle, "upper_leg0"),
+					self.gym.find_actor_rigid_body_handle(env_ptr, bot_handle, "upper_leg1"),
+					self.gym.find_actor_rigid_body_handle(env_ptr, bot_handle, "upper_leg2")
+				]
 
 			# create attractors to hold legs in place
-			attractor_props = gymapi.AttractorProperties()
-			attractor_props.stiffness = 5e7
-			attractor_props.damping = 5e3
-			attractor_props.axes = gymapi.AXIS_TRANSLATION
-			for current_handle in lower_leg_handles :
+			for k, current_handle in enumerate(lower_leg_handles) :
 				attractor_props.rigid_handle = current_handle
-				attractor_props.target.p.x = self.leg_outer_offset * math.cos(angle)
-				attractor_props.target.p.y = self.leg_outer_offset * math.sin(angle)
-				attractor_props.target.p.z = self.leg_radius
-				attractor_props.offset.p.z = 0.5 * self.leg_length
+				attractor_props.target.p.x = self.leg_outer_offset * self.leg_cos[k]
+				attractor_props.target.p.y = self.leg_outer_offset * self.leg_sin[k]
 				# place attractor!!!
 				self.gym.create_rigid_body_attractor(env_ptr, attractor_props)
 
 			# fancy colors
-			self.gym.set_rigid_body_color(env_ptr, ball_handle, 0, gymapi.MESH_VISUAL, gymapi.Vec3(0.99, 0.66, 0.25))
-			self.gym.set_rigid_body_color(env_ptr, bot_handle, 0, gymapi.MESH_VISUAL, gymapi.Vec3(0.48, 0.65, 0.8))
-			for j in range(1, 7) :
-				self.gym.set_rigid_body_color(env_ptr, bot_handle, j, gymapi.MESH_VISUAL, gymapi.Vec3(0.15, 0.2, 0.3))
+			if use_colors :
+				self.gym.set_rigid_body_color(env_ptr, ball_handle, 0, gymapi.MESH_VISUAL, ball_color)
+				for j, color in bot_colors :
+					self.gym.set_rigid_body_color(env_ptr, bot_handle, j, gymapi.MESH_VISUAL, color)
 
 	def compute_observations(self) :
 
-		actuated_dof_indices = torch.tensor([1,3,5], device=self.device)
-		self.obs_buf[..., 0:3] = self.dof_positions[..., actuated_dof_indices]
-		self.obs_buf[..., 3:6] = self.dof_velocities[..., actuated_dof_indices]
-		self.obs_buf[..., 6:9] = self.ball_positions
-		self.obs_buf[..., 9:12] = self.ball_linvels
-		self.obs_buf[..., 12:15] = self.sensor_forces[..., 0]		# !!! need to add normalization !!!
-		self.obs_buf[..., 15:18] = self.sensor_torques[..., 0]
-		self.obs_buf[..., 18:21] = self.sensor_torques[..., 1]
-		self.obs_buf[..., 21:24] = self.sensor_torques[..., 2]
+		# write the whole observation with a single cat into obs_buf
+		# torques are laid out component-major: x of all sensors, then y, then z
+		sensor_forces = self.sensor_forces[..., 0]		# !!! need to add normalization !!!
+		sensor_torques = self.sensor_torques.transpose(1, 2).reshape(self.num_envs, 9)
+		torch.cat([
+			self.dof_positions.index_select(-1, self._actuated_idx),
+			self.dof_velocities.index_select(-1, self._actuated_idx),
+			self._ball_pos_soa,
+			self._ball_linvel_soa,
+			sensor_forces,
+			sensor_torques
+		], dim=-1, out=self.obs_buf)
 
 		return self.obs_buf
 
+	def step(self, actions) :
+
+		obs_dict, rew, reset, extras = super().step(actions)
+		self._fill_bf16_obs(obs_dict)
+		return obs_dict, rew, reset, extras
+
+	def reset(self) :
+
+		obs_dict = super().reset()
+		self._fill_bf16_obs(obs_dict)
+		return obs_dict
+
+	def _fill_bf16_obs(self, obs_dict) :
+
+		# copied from the noised and clipped obs the rl framework gets, not from obs_buf
+		if self.bf16_obs :
+			self.obs_buf_bf16.copy_(obs_dict["obs"])
+			obs_dict["obs_bf16"] = self.obs_buf_bf16
+
 	def compute_reward(self) :
-		self.rew_buf[:], self.reset_buf[:] = compute_bot_reward(
+		compute_bot_reward(
 			tray_positions=self.tray_positions,
-			ball_positions=self.ball_positions,
-			ball_velocities=self.ball_linvels,
-			ball_radius=self.ball_radius,
+			ball_positions=self._ball_pos_soa,
+			ball_velocities=self._ball_linvel_soa,
+			target_positions=self._reward_target,
+			reset_height=self._reset_height,
+			rew_buf=self.rew_buf,
 			reset_buf=self.reset_buf,
 			progress_buf=self.progress_buf,
 			max_episode_length=self.max_episode_length
 		)
-		pass
 
 	def reset_idx(self, env_ids) :
-		
-		num_resets = len(env_ids)
-
-		self.root_states[env_ids] = self.initial_root_states[env_ids]
 
-		min_d = 0.001
-		max_d = 0.5
-		min_height = 1.0
-		max_height = 2.0
-		min_speed_xy = 0
-		max_speed_xy = 0
+		num_resets = len(env_ids)
 
-		dists = torch_rand_float(min_d, max_d, (num_resets, 1), self.device)
-		dirs = torch_random_dir_2((num_resets, 1), self.device)
-		hpos = dists * dirs
-		vpos = torch_rand_float(min_height, max_height, (num_resets, 1), self.device)
-
-		speedscales = (dists - min_d) / (max_d - min_d)
-		hspeeds = torch_rand_float(min_speed_xy, max_speed_xy, (num_resets, 1), self.device)
-		hvels = - speedscales * hspeeds * dirs
-		vspeeds = -torch_rand_float(5.0, 5.0, (num_resets, 1), self.device).squeeze()
-
-		self.ball_positions[env_ids, 0] = hpos[..., 0]
-		self.ball_positions[env_ids, 1] = hpos[..., 1]
-		self.ball_positions[env_ids, 2] = vpos[...]
-		self.ball_orientations[env_ids, 0:3] = 0	# quad
-		self.ball_orientations[env_ids, 3] = 1
-		self.ball_linvels[env_ids, 0] = hvels[..., 0]
-		self.ball_linvels[env_ids, 1] = hvels[..., 1]
-		self.ball_linvels[env_ids, 2] = vspeeds
-		self.ball_angvels[env_ids] = 0	# ball initially have no angular momentum
+		if self.reset_graph and num_resets == self.num_envs :
+			# env_ids come sorted from nonzero(), so a full reset always matches _all_env_ids
+			if self._full_reset_graph is None :
+				self._capture_full_reset()
+			else :
+				self._full_reset_graph.replay()
+		else :
+			self._reset_tensors(env_ids)
 
 		# reset root state for bots and balls
-		actor_indices = self.all_actor_indices[env_ids].flatten()
+		actor_indices = self._actor_idx_scratch[:num_resets].view(-1)
 		self.gym.set_actor_root_state_tensor_indexed(
 			self.sim,
 			self.root_tensor,
@@ -395,7 +448,7 @@ class BallBalance(VecTask) :
 		)
 
 		# reset DOF states for bots
-		bot_indices = self.all_bot_indices[env_ids].flatten()
+		bot_indices = self._bot_idx_scratch[:num_resets]
 		self.gym.set_dof_state_tensor_indexed(
 			self.sim,
 			self.dof_state_tensor,
@@ -403,21 +456,84 @@ class BallBalance(VecTask) :
 			len(bot_indices)
 		)
 
+	def _capture_full_reset(self) :
+
+		# warm up on a side stream, this run also does the actual reset
+		stream = torch.cuda.Stream()
+		stream.wait_stream(torch.cuda.current_stream())
+		with torch.cuda.stream(stream) :
+			self._reset_tensors(self._all_env_ids)
+		torch.cuda.current_stream().wait_stream(stream)
+
+		# only recorded here, replayed on the next full reset
+		self._full_reset_graph = torch.cuda.CUDAGraph()
+		with torch.cuda.graph(self._full_reset_graph) :
+			self._reset_tensors(self._all_env_ids)
+
+	def _reset_tensors(self, env_ids) :
+
+		# device side part of reset_idx, must not sync with the host so it can be captured
+		num_resets = env_ids.shape[0]
+
+		self.root_states[env_ids, 0] = self.initial_root_states[env_ids, 0]
+
+		min_d = 0.001
+		max_d = 0.5
+		min_height = 1.0
+		max_height = 2.0
+		min_speed_xy = 0
+		max_speed_xy = 0
+
+		# everything below works in place on views into _reset_rand and _ball_reset_states, no new tensors
+		rand = self._reset_rand[:num_resets].uniform_()
+		speedscales = rand[:, 0:1]	# (dists - min_d) / (max_d - min_d)
+		angles = rand[:, 1].mul_(2 * math.pi).sub_(math.pi)
+		vpos = rand[:, 2].mul_(max_height - min_height).add_(min_height)
+		hspeeds = rand[:, 3:4].mul_(max_speed_xy - min_speed_xy).add_(min_speed_xy).mul_(speedscales)	# already scaled by speedscales
+		dists = speedscales.mul_(max_d - min_d).add_(min_d)
+		vspeeds = -5.0
+
+		ball_states = self._ball_reset_states[:num_resets]
+		hpos = ball_states[:, 0:2]
+		hvels = ball_states[:, 7:9]
+
+		# horizontal direction first, then scale it into position and velocity
+		torch.cos(angles, out=ball_states[:, 0])
+		torch.sin(angles, out=ball_states[:, 1])
+		hvels.copy_(hpos).mul_(hspeeds).neg_()
+		hpos.mul_(dists)
+		ball_states[:, 2] = vpos
+		ball_states[:, 9] = vspeeds
+
+		# identity orientation and zero angular velocity are already in place, write the whole ball state at once
+		self.root_states[env_ids, 1] = ball_states
+
+		# actor indices for the indexed gym setters
+		torch.index_select(self.all_actor_indices, 0, env_ids, out=self._actor_idx_scratch[:num_resets])
+		torch.index_select(self.all_bot_indices, 0, env_ids, out=self._bot_idx_scratch[:num_resets])
+
 		self.reset_buf[env_ids] = 0
 		self.progress_buf[env_ids] = 0
 	
 	def pre_physics_step(self, _actions) :
 		
-		reset_env_ids = self.reset_buf.nonzero(as_tuple=False).squeeze(-1)
-		if len(reset_env_ids) > 0 :
+		# the mask stays on the device; the indexed gym setters in reset_idx still
+		# need the ids, so nonzero() is the only host sync left on this path
+		reset_mask = self.reset_buf != 0
+		reset_env_ids = reset_mask.nonzero(as_tuple=False).squeeze(-1)
+		if reset_env_ids.shape[0] > 0 :
 			self.reset_idx(reset_env_ids)
 		
-		actions = _actions.to(self.device)
-		actuated_indices = torch.LongTensor([1,3,5])
-
-		self.dof_position_targets[..., actuated_indices] += self.dt * self.action_speed_scale * actions
-		self.dof_position_targets[:] = tensor_clamp(self.dof_position_targets, self.bot_dof_lower_limits, self.bot_dof_upper_limits)
-		self.dof_position_targets[reset_env_ids] = 0
+		# policies normally hand over device float tensors already, only convert otherwise
+		actions = _actions
+		if actions.device != self._torch_device or actions.dtype != torch.float32 :
+			# only host to device copies may be async, a device to host copy must land before index_add_ reads it
+			actions = actions.to(device=self._torch_device, dtype=torch.float32, non_blocking=(self._torch_device.type != "cpu"))
+
+		# update position targets in place
+		self.dof_position_targets.index_add_(1, self._actuated_idx, actions, alpha=self.dt * self.action_speed_scale)
+		self.dof_position_targets.clamp_(self.bot_dof_lower_limits, self.bot_dof_upper_limits)
+		self.dof_position_targets.masked_fill_(reset_mask.unsqueeze(-1), 0)
 		self.gym.set_dof_position_target_tensor(self.sim, gymtorch.unwrap_tensor(self.dof_position_targets))
 	
 	def post_physics_step(self) :
@@ -427,39 +543,31 @@ class BallBalance(VecTask) :
 		self.gym.refresh_dof_state_tensor(self.sim)
 		self.gym.refresh_force_sensor_tensor(self.sim)
 
+		self._ball_pos_soa.copy_(self.ball_positions)
+		self._ball_linvel_soa.copy_(self.ball_linvels)
+
 		self.compute_observations()
 		self.compute_reward()
 
 		# visualize
 		if self.viewer and self.debug_viz :
 			self.gym.clear_lines(self.viewer)
-			for i in range(self.num_envs) :
+			for i in range(self.num_debug_viz_envs) :
 				env = self.envs[i]
-				bot_handle = self.bot_handles[i]
-				body_handles = []
-				body_handles.append(self.gym.find_actor_rigid_body_handle(env, bot_handle, "upper_leg0"))
-				body_handles.append(self.gym.find_actor_rigid_body_handle(env, bot_handle, "upper_leg1"))
-				body_handles.append(self.gym.find_actor_rigid_body_handle(env, bot_handle, "upper_leg2"))
-			for cur_handle in body_handles :
-				lpose = self.gym.get_rigid_transform(env, cur_handle)
-				gymutil.draw_lines(self.axes_geom, self.gym, self.viewer, env, lpose)
+				for cur_handle in self._upper_leg_handles :
+					lpose = self.gym.get_rigid_transform(env, cur_handle)
+					gymutil.draw_lines(self.axes_geom, self.gym, self.viewer, env, lpose)
 
 @torch.jit.script
-def compute_bot_reward(tray_positions, ball_positions, ball_velocities, ball_radius, reset_buf, progress_buf, max_episode_length):
-	# type: (Tensor, Tensor, Tensor, float, Tensor, Tensor, float) -> Tuple[Tensor, Tensor]
+def compute_bot_reward(tray_positions, ball_positions, ball_velocities, target_positions, reset_height, rew_buf, reset_buf, progress_buf, max_episode_length):
+	# type: (Tensor, Tensor, Tensor, Tensor, float, Tensor, Tensor, Tensor, float) -> None
+	# writes into rew_buf and reset_buf in place
 	# calculating the norm for ball distance to desired height above the ground plane (i.e. 0.7)
-	ball_dist = torch.sqrt(ball_positions[..., 0] * ball_positions[..., 0] +
-						   (ball_positions[..., 2] - 0.7) * (ball_positions[..., 2] - 0.7) +
-						   (ball_positions[..., 1]) * ball_positions[..., 1])
-	ball_speed = torch.sqrt(ball_velocities[..., 0] * ball_velocities[..., 0] +
-							ball_velocities[..., 1] * ball_velocities[..., 1] +
-							ball_velocities[..., 2] * ball_velocities[..., 2])
-	pos_reward = 1.0 / (1.0 + ball_dist)
-	speed_reward = 1.0 / (1.0 + ball_speed)
-	reward = pos_reward * speed_reward
+	ball_dist = torch.linalg.vector_norm(ball_positions - target_positions, dim=-1)
+	ball_speed = torch.linalg.vector_norm(ball_velocities, dim=-1)
+	torch.mul(1.0 + ball_dist, 1.0 + ball_speed, out=rew_buf)
+	rew_buf.reciprocal_()
 
 	# update the stopped sequences
-	reset = torch.where(progress_buf >= max_episode_length - 1, torch.ones_like(reset_buf), reset_buf)
-	reset = torch.where(ball_positions[..., 2] < ball_radius * 1.5, torch.ones_like(reset_buf), reset)
+	reset_buf.copy_((reset_buf != 0) | (progress_buf >= max_episode_length - 1) | (ball_positions[..., 2] < reset_height))
 
-	return reward, reset
\ No newline at end of file